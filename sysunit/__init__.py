@@ -15,6 +15,7 @@ __all__ = [
 def load_tests(loader, tests, ignore):
     import doctest
 
+    tests.addTests(doctest.DocTestSuite(unit_configs))
     tests.addTests(doctest.DocTestSuite(systemdconfigs))
     tests.addTests(doctest.DocTestSuite(commands))
     return tests
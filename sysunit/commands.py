@@ -2,6 +2,15 @@ import typing
 import asyncio 
 from types import SimpleNamespace
 
+_PIPE = asyncio.subprocess.PIPE
+
+
+def _decode(output: typing.Optional[bytes], encoding: str) -> str:
+    # most commands (start, stop, daemon-reload, ...) produce no output
+    if not output:
+        return ''
+    return output.decode(encoding, 'replace')
+
 
 class _Run:
     """Defines a set of methods that run systemd commands.
@@ -86,23 +95,29 @@ class _Run:
     ...
     >>> my_unit.remove()
     """
-    def __init__(self, sysunit, manager: str = '--user'):
+    def __init__(self, sysunit, manager: str = '--user',
+                 concurrency: int = 16):
         self.sysunit = sysunit
         # TODO: store the last status here (or store in SysUnit?)
         self.last = SimpleNamespace
         assert manager in ['--user', '--system']
         self.manager = manager
+        assert concurrency > 0
+        # maximal number of systemctl processes running at the same time
+        self.concurrency = concurrency
 
     async def async_systemctl(self,
                               unit: str,
                               command: str,
-                              env: dict = None,
-                              stdout=asyncio.subprocess.PIPE,
-                              stderr=asyncio.subprocess.PIPE,
+                              env: typing.Optional[dict] = None,
+                              stdout=_PIPE,
+                              stderr=_PIPE,
                               encoding='utf-8'
                               ):
         """Run systemctl command asynchronously
 
+        If `env` is None the environment of the current process is used.
+
         Returns:
 
         stdout, stderr
@@ -114,14 +129,25 @@ class _Run:
             *args, env=env, stdout=stdout, stderr=stderr
         )
         stdout, stderr = await proc.communicate()
-        return stdout.decode(encoding), stderr.decode(encoding)
+        return _decode(stdout, encoding), _decode(stderr, encoding)
+
+    async def _bounded_systemctl(self, semaphore, *args, **kwargs):
+        async with semaphore:
+            return await self.async_systemctl(*args, **kwargs)
 
-    async def _unit_cmd(self, command, instance, env):
+    async def _unit_cmd(self, command, instance,
+                        env: typing.Optional[dict] = None):
         if self.sysunit.is_batched:
             stdout, stderr = {}, {}
-            for name in self.sysunit.expanded_names(instance=instance):
-                _stdout, _stderr = await self.async_systemctl(
-                        name, command, env=env)
+            names = self.sysunit._names(instance)
+            # the units are independent, run systemctl for all concurrently
+            # but with at most `concurrency` processes at once
+            semaphore = asyncio.Semaphore(self.concurrency)
+            results = await asyncio.gather(
+                    *(self._bounded_systemctl(semaphore, name, command,
+                                              env=env)
+                      for name in names))
+            for name, (_stdout, _stderr) in zip(names, results):
                 stdout[name] = _stdout
                 stderr[name] = _stderr
         else:
@@ -1,6 +1,6 @@
+import re
 import sys
-import itertools
-from collections.abc import Iterable
+import functools
 
 from configparser import (
         SectionProxy, RawConfigParser,
@@ -9,18 +9,49 @@ from configparser import (
 )
 
 
+@functools.lru_cache(maxsize=None)
+def _inline_comment_re(prefixes: tuple):
+    """Regex finding the first inline comment, `None` without `prefixes`
+
+    An inline comment starts at a prefix that begins the line or follows a
+    whitespace.
+    """
+    if not prefixes:
+        return None
+    return re.compile(r'(?:^|(?<=\s))(?:{})'.format(
+        '|'.join(re.escape(prefix) for prefix in prefixes)))
+
+
 class MultiConfigParser(RawConfigParser):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._multioptions = set()
+        # {section: {option, ...}} of options holding a list of values
+        self._multioptions = {}
+
+    def _comment_prefix_groups(self):
+        """The full line and the inline comment prefixes, as tuples
+
+        Since python 3.13 `RawConfigParser` keeps both in `_prefixes`.
+        """
+        prefixes = getattr(self, '_prefixes', None)
+        if prefixes is not None:
+            return tuple(prefixes.full), tuple(prefixes.inline)
+        return (tuple(self._comment_prefixes),
+                tuple(self._inline_comment_prefixes))
 
     def set(self, section, option, value=None, multioption=False):
         if multioption:
             if not isinstance(value, list):
                 value = [value]
-            self._multioptions.add((section, option))
+            self._add_multi(section, option)
         super().set(section=section, option=option, value=value)
 
+    def _is_multi(self, section, option):
+        return option in self._multioptions.get(section, ())
+
+    def _add_multi(self, section, option):
+        self._multioptions.setdefault(section, set()).add(option)
+
     def append(self, section, option, value=None):
         """Add another value to an existing option making it multioption
         """
@@ -53,69 +84,78 @@ class MultiConfigParser(RawConfigParser):
         cursect = None                        # None, or a dictionary
         sectname = None
         optname = None
+        optlines = None                       # None, or a list of lines
+        pending = None                        # option waiting to be stored
         lineno = 0
         indent_level = 0
         e = None                              # None, or an exception
+        # bind attributes used on every line to locals
+        comment_prefixes, inline_prefixes = self._comment_prefix_groups()
+        inline_comment_re = _inline_comment_re(inline_prefixes)
+        empty_lines_in_values = self._empty_lines_in_values
+        sectcre = self.SECTCRE
+        optcre = self._optcre
+        optionxform = self.optionxform
+        strict = self._strict
+        sections = self._sections
+        proxies = self._proxies
+        dict_type = self._dict
+        default_section = self.default_section
+        defaults = self._defaults
+        multioptions = self._multioptions
+        store_option = self._store_option
         for lineno, line in enumerate(fp, start=1):
-            comment_start = sys.maxsize
+            comment_start = None
             # strip inline comments
-            inline_prefixes = {p: -1 for p in self._inline_comment_prefixes}
-            while comment_start == sys.maxsize and inline_prefixes:
-                next_prefixes = {}
-                for prefix, index in inline_prefixes.items():
-                    index = line.find(prefix, index+1)
-                    if index == -1:
-                        continue
-                    next_prefixes[prefix] = index
-                    if index == 0 or (index > 0 and line[index-1].isspace()):
-                        comment_start = min(comment_start, index)
-                inline_prefixes = next_prefixes
+            if inline_comment_re is not None:
+                mo = inline_comment_re.search(line)
+                if mo:
+                    comment_start = mo.start()
             # strip full line comments
-            for prefix in self._comment_prefixes:
-                if line.strip().startswith(prefix):
-                    comment_start = 0
-                    break
-            if comment_start == sys.maxsize:
-                comment_start = None
+            if line.strip().startswith(comment_prefixes):
+                comment_start = 0
             value = line[:comment_start].strip()
             if not value:
-                if self._empty_lines_in_values:
+                if empty_lines_in_values:
                     # add empty line to the value, but only if there was no
                     # comment on the line
                     if (comment_start is None and
                             cursect is not None and
                             optname and
-                            cursect[optname] is not None):
-                        cursect[optname].append('')  # newlines added at join
+                            optlines is not None):
+                        optlines.append('')  # newlines added at join
                 else:
                     # empty line marks end of value
                     indent_level = sys.maxsize
                 continue
             # continuation line?
-            first_nonspace = self.NONSPACECRE.search(line)
-            cur_indent_level = first_nonspace.start() if first_nonspace else 0
+            # blank lines are handled above, so there is a non-space char
+            cur_indent_level = len(line) - len(line.lstrip())
             if (cursect is not None and optname and
                     cur_indent_level > indent_level):
-                cursect[optname].append(value)
+                optlines.append(value)
             # a section header or option header?
             else:
                 indent_level = cur_indent_level
                 # is it a section header?
-                mo = self.SECTCRE.match(value)
+                mo = sectcre.match(value)
                 if mo:
+                    if pending is not None:
+                        store_option(*pending)
+                        pending = None
                     sectname = mo.group('header')
-                    if sectname in self._sections:
-                        if self._strict and sectname in elements_added:
+                    if sectname in sections:
+                        if strict and sectname in elements_added:
                             raise DuplicateSectionError(sectname, fpname,
                                                         lineno)
-                        cursect = self._sections[sectname]
+                        cursect = sections[sectname]
                         elements_added.add(sectname)
-                    elif sectname == self.default_section:
-                        cursect = self._defaults
+                    elif sectname == default_section:
+                        cursect = defaults
                     else:
-                        cursect = self._dict()
-                        self._sections[sectname] = cursect
-                        self._proxies[sectname] = SectionProxy(self, sectname)
+                        cursect = dict_type()
+                        sections[sectname] = cursect
+                        proxies[sectname] = SectionProxy(self, sectname)
                         elements_added.add(sectname)
                     # So sections can't start with a continuation line
                     optname = None
@@ -124,13 +164,15 @@ class MultiConfigParser(RawConfigParser):
                     raise MissingSectionHeaderError(fpname, lineno, line)
                 # an option line?
                 else:
-                    mo = self._optcre.match(value)
+                    mo = optcre.match(value)
                     if mo:
+                        if pending is not None:
+                            store_option(*pending)
                         optname, vi, optval = mo.group('option', 'vi', 'value')
                         if not optname:
                             e = self._handle_error(e, fpname, lineno, line)
-                        optname = self.optionxform(optname.rstrip())
-                        if (self._strict and
+                        optname = optionxform(optname.rstrip())
+                        if (strict and
                                 (sectname, optname) in elements_added):
                             raise DuplicateOptionError(sectname, optname,
                                                        fpname, lineno)
@@ -138,51 +180,61 @@ class MultiConfigParser(RawConfigParser):
                         # This check is fine because the OPTCRE cannot
                         # match if it would set optval to None
                         if optval is not None:
-                            optval = optval.strip()
-                            if (optname in cursect):
-                                self._multioptions.add((sectname, optname))
-                                cursect[optname].append(optval)
-                            else:
-                                cursect[optname] = [optval]
+                            optlines = [optval.strip()]
+                            # a repeated option becomes a multioption
+                            multi = optname in cursect
+                            if multi:
+                                multioptions.setdefault(
+                                    sectname, set()).add(optname)
+                                if not isinstance(cursect[optname], list):
+                                    cursect[optname] = [cursect[optname]]
                         else:
-                            # valueless option handling
-                            cursect[optname] = None
+                            # valueless option handling, a repeated valueless
+                            # option is simply stored (once) as `None`
+                            optlines = None
+                            multi = False
+                        pending = (cursect, sectname, optname, optlines,
+                                   multi)
                     else:
                         # a non-fatal parsing error occurred. set up the
                         # exception but keep going. the exception will be
                         # raised at the end of the file and will contain a
                         # list of all bogus lines
                         e = self._handle_error(e, fpname, lineno, line)
-        self._join_multiline_values()
+        if pending is not None:
+            store_option(*pending)
         # if any parsing errors occurred, raise an exception
         if e:
             raise e
 
+    def _store_option(self, cursect, sectname, optname, lines, multi):
+        """Join the lines of a value read by `_read` and store it in cursect
+        """
+        if lines is not None:
+            value = '\n'.join(lines).rstrip()
+        else:
+            value = None
+        value = self._interpolation.before_read(self, sectname, optname,
+                                                value)
+        if multi:
+            cursect[optname].append(value)
+        else:
+            cursect[optname] = value
+
     def _write_section(self, fp, section_name, section_items, delimiter):
         """Write a single section to the specified `fp'."""
-        fp.write("[{}]\n".format(section_name))
+        # collect the lines to write the whole section at once
+        parts = [f"[{section_name}]\n"]
         for key, value in section_items:
             value = self._interpolation.before_write(self, section_name, key,
                                                      value)
-            if not (section_name, key) in self._multioptions:
+            if not self._is_multi(section_name, key):
                 value = [value, ]
             for _value in value:
                 if _value is not None or not self._allow_no_value:
-                    _value = delimiter + str(_value).replace('\n', '\n\t')
+                    _value = f"{delimiter}{_value}".replace('\n', '\n\t')
                 else:
                     _value = ""
-                fp.write("{}{}\n".format(key, _value))
-        fp.write("\n")
-
-    def _join_multiline_values(self):
-        defaults = self.default_section, self._defaults
-        all_sections = itertools.chain((defaults,),
-                                       self._sections.items())
-        for section, options in all_sections:
-            for name, val in options.items():
-                if (isinstance(val, Iterable)
-                        and not (section, name) in self._multioptions):
-                    val = '\n'.join(val).rstrip()
-                options[name] = self._interpolation.before_read(self,
-                                                                section,
-                                                                name, val)
+                parts.append(f"{key}{_value}\n")
+        parts.append("\n")
+        fp.write("".join(parts))
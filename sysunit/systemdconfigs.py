@@ -1,21 +1,42 @@
 import os
+import re
 import copy
 import typing
+import functools
 import warnings
+import contextlib
 from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
 
 from .unit_configs import (
         UnitConfig,
         TargetConfig,
         ServiceConfig,
         TimerConfig,
-        PathConfig
+        PathConfig,
+        _write_unit_file
     )
-from .utils import noglobals
+from .utils import noglobals, _compile_template
 from .commands import _Run
 
+# upper bound of threads writing the unit files of a batch
+_MAX_WRITERS = 32
+
+# equal batch values of these types always give the same unit name
+_NAME_KEY_TYPES = frozenset((str, int, bool))
+
+# <name>[@][.<type>], the name and type contain no "." and the name no "@"
+_NAME_RE = re.compile(
+    r'(?P<name>[^.@]*)(?P<template>@)?(?:\.(?P<type>[^.]*))?')
+
 
 class SystemUnit(object):
+    # many units can be alive at once, so avoid a per-instance __dict__
+    __slots__ = ('_type', '_template', '_template_str', '_name', '_batched',
+                 '_full_name_cached', '_names_cache', '_path',
+                 '_expanded_path', '_path_prefix', '_config', '_batch_vars',
+                 'run', '__weakref__')
+
     def __init__(self,
                  name,
                  unit_config: typing.Optional[UnitConfig] = None,
@@ -60,7 +81,6 @@ class SystemUnit(object):
         self.name = name
         self.path = path
         self._init_config(unit_config)
-        self._init_batch_vars()
         self.run = _Run(self, manager)
 
     def _init_config(self, unit_config):
@@ -90,8 +110,20 @@ class SystemUnit(object):
         """Append other value to an option in a section"""
         return self.config.append(section, option, value)
 
-    def _init_batch_vars(self,):
-        self.batch_vars = SimpleNamespace()
+    @property
+    def batch_vars(self):
+        """Values to format a batched unit with (see `expanded_names`)"""
+        try:
+            return self._batch_vars
+        except AttributeError:
+            # most units are not batched, only create the namespace when used
+            self._batch_vars = SimpleNamespace()
+            return self._batch_vars
+
+    @batch_vars.setter
+    def batch_vars(self, batch_vars: SimpleNamespace):
+        self._batch_vars = batch_vars
+        self._names_cache = None
 
     @property
     def config(self):
@@ -112,12 +144,16 @@ class SystemUnit(object):
         You might use `'~'` in the path, it will be replaced by the user's
         home directory, so the path `'~/.config/systemd/user'` is a valid path.
         """
-        return os.path.expanduser(self._path)
+        return self._expanded_path
 
     @path.setter
     def path(self, path: str):
         # TODO: check if this is a valid location for systemd unit files
         self._path = path
+        self._expanded_path = os.path.expanduser(path)
+        # `os.path.join` adds a separator only where needed, unit names are
+        # never absolute so `_filename` can simply concatenate
+        self._path_prefix = os.path.join(self._expanded_path, '')
 
     @property
     def name(self):
@@ -163,30 +199,36 @@ class SystemUnit(object):
 
     @name.setter
     def name(self, name: str):
+        mo = _NAME_RE.fullmatch(name)
+        if mo is None:
+            raise AssertionError(self._invalid_name_msg(name))
+        _name, _template, _type = mo.group('name', 'template', 'type')
         # fetch the unit type
-        parts = name.split('.')
-        assert len(parts) <= 2, '`name` can contain only a single ".",'\
-            f'"{name}" is not permitted.'
-        _name = parts[0]
-        _type = None
-        if len(parts) == 2:
-            _type = parts[1]
         if _type:
             self.type = _type
         # determine if it is a template
-        name_parts = _name.split('@')
-        assert len(name_parts) <= 2, 'The name can only contain a'\
-            f' single "@", "{name}" is not permitted.'
-        _name = name_parts.pop(0)
-        if len(name_parts):
-            assert name_parts[0] == '', '`name` can only contain a "@" at its'\
-                    ' end (or before the file extension, if provided).'\
-                    f'"{name}" is thus not a valid name.'
+        if _template:
             self.template = True
         self._name = _name
-        self._batched = False
-        if '{' in self._name and '}' in self._name:
-            self._batched = True
+        self._batched = '{' in _name and '}' in _name
+        self._names_changed()
+
+    def _name_formatter(self):
+        """The `format_map` equivalent formatting the name of batched units"""
+        # not kept on the instance, the compiled template cannot be pickled
+        return _compile_template(self._name)
+
+    @staticmethod
+    def _invalid_name_msg(name: str):
+        if name.count('.') > 1:
+            return '`name` can contain only a single ".",'\
+                f'"{name}" is not permitted.'
+        if name.partition('.')[0].count('@') > 1:
+            return 'The name can only contain a'\
+                f' single "@", "{name}" is not permitted.'
+        return '`name` can only contain a "@" at its'\
+            ' end (or before the file extension, if provided).'\
+            f'"{name}" is thus not a valid name.'
 
     @property
     def is_batched(self):
@@ -201,12 +243,22 @@ class SystemUnit(object):
         This method does not compare if the configuration of the existing file
         matched.
 
-        See `exists` for an example
+        See `exists` for an example, the names follow any change of the batch
+        variables, even to equal values of another type:
+
+        >>> my_unit = SystemUnit(name='test_unit-{case}.service')
+        >>> my_unit.batch_vars.case = [1, 2]
+        >>> my_unit.write()
+        >>> my_unit.existing
+        ['test_unit-1.service', 'test_unit-2.service']
+        >>> my_unit.batch_vars.case = [True, 2]
+        >>> my_unit.existing
+        ['test_unit-2.service']
+        >>> my_unit.batch_vars.case = [1, 2]
+        >>> my_unit.remove()
         """
         assert self._batched, 'This method is only allowed for batched units'
-        return [name
-                for name in self.expanded_names()
-                if os.path.exists(self._filename(name))]
+        return self._existing_names(self._names(None))
 
     @property
     def exists(self):
@@ -252,11 +304,31 @@ class SystemUnit(object):
         >>> my_unit.exists
         False
         """
-        return all((os.path.exists(self._filename(name))
-                    for name in self.expanded_names()))
+        names = self._names(None)
+        return len(self._existing_names(names)) == len(names)
+
+    def _existing_names(self, names):
+        """Filter `names` down to the units with a file in `path`"""
+        if len(names) == 1:
+            return [name for name in names
+                    if os.path.exists(self._filename(name))]
+        # list the directory once instead of a stat per unit
+        try:
+            with os.scandir(self.path) as entries:
+                # like `os.path.exists`, dangling symlinks do not count
+                found = {entry.name for entry in entries
+                         if not entry.is_symlink()
+                         or os.path.exists(entry.path)}
+        except FileNotFoundError:
+            return []
+        except OSError:
+            # e.g. a directory that can be searched but not listed
+            return [name for name in names
+                    if os.path.exists(self._filename(name))]
+        return [name for name in names if name in found]
 
     def _filename(self, name):
-        return os.path.join(self.path, name)
+        return self._path_prefix + name
 
     @property
     def full_name(self):
@@ -271,7 +343,9 @@ class SystemUnit(object):
         my_unit@.service
 
         """
-        return self._full_name(self.name)
+        if self._full_name_cached is None:
+            self._full_name_cached = self._full_name(self.name)
+        return self._full_name_cached
 
     def expanded_name(self,
                       instance: typing.Optional[str] = None,
@@ -332,20 +406,66 @@ class SystemUnit(object):
         >>> for unit_name in my_unit_batch.expanded_names(instance='hello'):
         ...     unit_name
         'my_unit@hello.service'
+
+        All batch variables need to provide the same number of values:
+
+        >>> my_unit_batch = SystemUnit(name='my_unit-{custom}-{other}.service')
+        >>> my_unit_batch.batch_vars.custom = ['bla', 'blu']
+        >>> my_unit_batch.batch_vars.other = ['x']
+        >>> my_unit_batch.expanded_names()  # doctest: +ELLIPSIS
+        Traceback (most recent call last):
+        ...
+        AssertionError: All batch variables need the same number of values...
         """
         if not self._batched:
             return [self.expanded_name(instance=instance), ]
         else:
-            names = []
-            batched_variables = self._get_batched_vars()
-            nbr_values = len(next(iter(batched_variables.values())))
-            for i in range(nbr_values):
-                _variables = {k: v[i] for k, v in batched_variables.items()}
-                names.append(
-                    self._full_name(self._formatted_name(**_variables),
-                                    instance)
-                )
-            return names
+            # only the name part differs between the units
+            format_name = self._name_formatter()
+            suffix = self._full_name('', instance)
+            return [format_name(_variables) + suffix
+                    for _variables in self._batch_rows()]
+
+    def _names(self, instance):
+        """Tuple of the `expanded_names`, reused while nothing changed
+
+        The last result is kept along with the `instance` and a snapshot of
+        the batch variables it was computed for.
+        """
+        if not self._batched:
+            return (self.expanded_name(instance=instance), )
+        snapshot = self._batch_vars_snapshot()
+        if snapshot is None:
+            return tuple(self.expanded_names(instance=instance))
+        key = (instance, snapshot)
+        cached = self._names_cache
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        names = tuple(self.expanded_names(instance=instance))
+        self._names_cache = (key, names)
+        return names
+
+    def _names_changed(self):
+        """Drop the cached names after a change of name, type or template"""
+        self._full_name_cached = None
+        self._names_cache = None
+
+    def _batch_vars_snapshot(self):
+        """The batch variables as a cache key, `None` if they can not be one
+
+        The values are kept along with their types, as equal values of
+        different types, like `1` and `True`, give different names. Values
+        of other types than `_NAME_KEY_TYPES` are never cached, equal values
+        could be formatted differently or change unnoticed.
+        """
+        snapshot = []
+        for key, values in vars(self.batch_vars).items():
+            values = tuple(values)
+            types = tuple(map(type, values))
+            if not _NAME_KEY_TYPES.issuperset(types):
+                return None
+            snapshot.append((key, values, types))
+        return tuple(snapshot)
 
     def _full_name(self, name, instance: typing.Optional[str] = None):
         if instance is None:
@@ -355,8 +475,7 @@ class SystemUnit(object):
     def to_dict(self):
         """Export the configuration to a dictionary
         """
-        return {sect: dict(self.config[sect])
-                for sect in self.config.sections()}
+        return self.config.to_dict()
 
     def from_dict(self, unit_dict: dict):
         """Load a configuration from a dictionary
@@ -376,7 +495,7 @@ class SystemUnit(object):
            file.
         """
         for service, options in unit_dict.items():
-            if service not in self.config.sections():
+            if not self.config.has_section(service):
                 self.config.add_section(service)
             for name, value in options.items():
                 if not isinstance(value, tuple):
@@ -394,6 +513,7 @@ class SystemUnit(object):
     def type(self, type: str):
         # TODO: make sure the type is a valid type
         self._type = type
+        self._names_changed()
         # NOTE: to get rid of once UnitConfig drops extension
         if hasattr(self, '_config'):
             self._config.extension = self._type
@@ -410,12 +530,33 @@ class SystemUnit(object):
             self._template_str = '@'
         else:
             self._template_str = ''
+        self._names_changed()
 
-    def write(self):
+    def write(self, parallel: bool = True):
         """Write the unit out to file
+
+        Parameters:
+        -----------
+        :param: parallel
+           For batched units only, whether the unit files are written
+           concurrently from a pool of threads. With `parallel=False` the files
+           are written one after the other, stopping at the first error.
+
+        Example:
+
+        >>> my_unit = SystemUnit(name='test_unit-{case}.service')
+        >>> my_unit.batch_vars.case = [1, 2]
+        >>> my_unit.write(parallel=False)
+        >>> my_unit.existing
+        ['test_unit-1.service', 'test_unit-2.service']
+        >>> my_unit.remove()
+        >>> my_unit.write()  # the same files, written concurrently
+        >>> my_unit.existing
+        ['test_unit-1.service', 'test_unit-2.service']
+        >>> my_unit.remove()
         """
         if self._batched:
-            self._write_batch()
+            self._write_batch(parallel=parallel)
         else:
             self._write(config=self.config,
                         path=self.path,
@@ -424,9 +565,86 @@ class SystemUnit(object):
     def _write(self, config, name, path):
         config.write_config(path=path, name=name)
 
-    def _write_batch(self):
-        for name, config in self.batched_configs:
-            self._write(config=config, path=self.path, name=name)
+    def _write_batch(self, parallel: bool = True):
+        """Write the unit files of a batch
+
+        The files are the same as writing each of the `batched_configs`:
+
+        >>> import tempfile
+        >>> batch_dir = tempfile.TemporaryDirectory()
+        >>> single_dir = tempfile.TemporaryDirectory()
+        >>> my_unit = SystemUnit(name='my_unit-{case}.service',
+        ...                      path=batch_dir.name)
+        >>> my_unit.batch_vars.case = ['a', 'b']
+        >>> my_unit.set('Unit', 'Description', 'unit {case}\\nsecond line')
+        >>> my_unit.set('Service', 'ExecStart', ['/bin/{case}', '/bin/true'],
+        ...             multioption=True)
+        >>> my_unit.config.update_internal_section('Meta', case='{case}')
+        >>> my_unit._write_batch()
+        >>> for name, config in my_unit.batched_configs:
+        ...     config.write_config(single_dir.name, name=name)
+        ...     with open(os.path.join(batch_dir.name, name)) as batch, \\
+        ...             open(os.path.join(single_dir.name, name)) as single:
+        ...         batch.read() == single.read()
+        True
+        True
+        >>> batch_dir.cleanup()
+        >>> single_dir.cleanup()
+        """
+        # only the values differ between the units of a batch, so lay out
+        # the file once and only format the values for each unit
+        render = self.config._batch_renderer()
+        format_name = self._name_formatter()
+        suffix = self._full_name('')
+        # rows leading to the same file name: the last one wins, as it would
+        # when writing the files one after the other
+        files = {}
+        for _variables in self._batch_rows():
+            files[format_name(_variables) + suffix] = render(_variables)
+        files = list(files.items())
+        if not files:
+            return
+        if len(files) == 1:
+            name, content = files[0]
+            _write_unit_file(self._filename(name), content)
+            return
+        with self._unit_dir() as dir_fd:
+            if dir_fd is None:
+                files = [(self._filename(name), content)
+                         for name, content in files]
+            write = functools.partial(_write_unit_file, dir_fd=dir_fd)
+            if not parallel:
+                for name, content in files:
+                    write(name, content)
+                return
+            # the files are independent, overlap the blocking writes in threads
+            with ThreadPoolExecutor(max_workers=min(_MAX_WRITERS,
+                                                    len(files))) as executor:
+                # consume the results so that errors are raised here
+                for _ in executor.map(lambda f: write(*f), files):
+                    pass
+
+    @contextlib.contextmanager
+    def _unit_dir(self):
+        """Open `path` once to resolve many unit files relative to it
+
+        Yields the directory file descriptor, or `None` if the platform lacks
+        `dir_fd` support or the directory cannot be opened, in which case the
+        full paths should be used (and raise the appropriate errors).
+        """
+        if not {os.open, os.unlink} <= os.supports_dir_fd or \
+                not hasattr(os, 'O_DIRECTORY'):
+            yield None
+            return
+        try:
+            dir_fd = os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            yield None
+            return
+        try:
+            yield dir_fd
+        finally:
+            os.close(dir_fd)
 
     @property
     def batched_configs(self):
@@ -450,25 +668,38 @@ class SystemUnit(object):
         my_unit-bli.service
         {'Unit': {'Description': 'something bli'}, 'Service': {}}
         """
-        batched_variables = self._get_batched_vars()
-        nbr_values = len(next(iter(batched_variables.values())))
         # for each name create a new config {name: config, ...}
-        for i in range(nbr_values):
-            _variables = {k: v[i] for k, v in batched_variables.items()}
+        for _variables in self._batch_rows():
             new_config = copy.deepcopy(self.config)
             name = self._full_name(self._formatted_name(**_variables))
             config = self._formatted_config(new_config, **_variables)
             yield name, config
 
     def _get_batched_vars(self):
-        assert vars(self.batch_vars), "Missing batch variables.\nDid you"\
+        batched_variables = vars(self.batch_vars)
+        assert batched_variables, "Missing batch variables.\nDid you"\
                 " forget to specify your batch variables in"\
                 " `self.batch_vars?"
-        return vars(self.batch_vars)
+        return batched_variables
+
+    def _batch_rows(self):
+        """Generator over the variables of each unit in a batch
+
+        All batch variables must provide the same number of values, which is
+        checked before anything is yielded.
+        """
+        batched_variables = self._get_batched_vars()
+        keys = tuple(batched_variables)
+        columns = tuple(batched_variables.values())
+        lengths = {key: len(col) for key, col in zip(keys, columns)}
+        assert len(set(lengths.values())) == 1, "All batch variables need"\
+                f" the same number of values, got {lengths}"
+        for row in zip(*columns):
+            yield dict(zip(keys, row))
 
     @noglobals
     def _formatted_name(self, **variables):
-        return self.name.format(**variables)
+        return self._name_formatter()(variables)
 
     # @noglobals
     # def _formatted_instance_name(self,
@@ -490,9 +721,17 @@ class SystemUnit(object):
         """Remove unit files from disk.
         """
         # TODO: allow removal of single unit if it is _batched
-        for name in self.expanded_names():
+        if not self._batched:
+            self._remove(self._names(None), dir_fd=None)
+            return
+        with self._unit_dir() as dir_fd:
+            self._remove(self._names(None), dir_fd=dir_fd)
+
+    def _remove(self, names, dir_fd):
+        for name in names:
             try:
-                os.remove(os.path.join(self.path, name))
+                os.unlink(self._filename(name) if dir_fd is None else name,
+                          dir_fd=dir_fd)
             except FileNotFoundError:
                 warnings.warn(f'No unit matching the name {name} to remove at'
                               f'{self.path}', Warning)
@@ -1,76 +1,305 @@
 import os
-import copy
-from collections import OrderedDict
-
-from .utils import noglobals
+import sys
+import stat
+import functools
+import itertools
+from configparser import (
+        SectionProxy, ConverterMapping, Interpolation, NoSectionError,
+        DuplicateSectionError, MissingSectionHeaderError
+)
+
+from .utils import noglobals, _compile_template
 from .configs import MultiConfigParser
 
+# buffer size when reading unit files, large enough to handle any
+# reasonable unit file with a single system call
+_BUFFER_SIZE = 1 << 17
+
+# same as `open(filename, 'w')`, without newline translation on any platform
+_WRITE_FLAGS = (os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+                | getattr(os, 'O_BINARY', 0))
+
+# makes the temporary file names unique among the threads of a process
+_tmp_counter = itertools.count()
+
+
+def _write_unit_file(filename: str, content: str, dir_fd: int = None):
+    """Write the rendered content of a unit to a file
+
+    The content is encoded at once and written with `os.write` to a temporary
+    file next to `filename`, which then replaces it. This way systemd never
+    sees a partially written unit file. The permissions of an existing file
+    are kept and symlinked unit files are written through the link.
+    If `dir_fd` is given, `filename` is relative to this directory descriptor.
+
+    Example:
+
+    >>> import tempfile
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> unit_file = os.path.join(tmp.name, 'my_unit.service')
+    >>> _write_unit_file(unit_file, '[Unit]\\n')
+    >>> os.chmod(unit_file, 0o600)
+    >>> _write_unit_file(unit_file, '[Service]\\n')
+    >>> oct(stat.S_IMODE(os.stat(unit_file).st_mode))
+    '0o600'
+    >>> link = os.path.join(tmp.name, 'linked.service')
+    >>> os.symlink(unit_file, link)
+    >>> _write_unit_file(link, '[Timer]\\n')
+    >>> os.path.islink(link), open(unit_file).read()
+    (True, '[Timer]\\n')
+    >>> sorted(os.listdir(tmp.name))  # no temporary file is left behind
+    ['linked.service', 'my_unit.service']
+    >>> try:
+    ...     _write_unit_file(os.path.join(tmp.name, 'no', 'x.service'), '')
+    ... except FileNotFoundError as err:
+    ...     os.path.relpath(err.filename, tmp.name)
+    'no/x.service'
+    >>> tmp.cleanup()
+    """
+    data = memoryview(content.encode('utf-8'))
+    try:
+        current = os.stat(filename, dir_fd=dir_fd, follow_symlinks=False)
+    except FileNotFoundError:
+        current = None
+    if current is not None and stat.S_ISLNK(current.st_mode):
+        _write_fd_at(filename, data, dir_fd, mode=None)
+        return
+    head, tail = os.path.split(filename)
+    tmpname = os.path.join(
+        head, f'.{tail}.{os.getpid()}.{next(_tmp_counter)}.tmp'
+    )
+    try:
+        _write_fd_at(tmpname, data, dir_fd,
+                     mode=None if current is None
+                     else stat.S_IMODE(current.st_mode),
+                     flags=_WRITE_FLAGS | os.O_EXCL)
+        os.replace(tmpname, filename, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+    except BaseException as err:
+        try:
+            os.unlink(tmpname, dir_fd=dir_fd)
+        except OSError:
+            pass
+        if isinstance(err, OSError) and err.filename == tmpname:
+            # report the unit file, the temporary file is a detail
+            raise type(err)(err.errno, err.strerror, filename) from err
+        raise
+
+
+def _write_fd_at(filename: str, data: memoryview, dir_fd: int, mode: int,
+                 flags: int = _WRITE_FLAGS):
+    fd = os.open(filename, flags, 0o666, dir_fd=dir_fd)
+    try:
+        if mode is not None:
+            os.chmod(fd, mode)
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
 
 class UnitConfig(MultiConfigParser):
+    # reachable from the `noglobals` decorated `formatted`, which has no
+    # access to the builtins on every python version
+    _compile_template = staticmethod(_compile_template)
+    _isinstance = staticmethod(isinstance)
+    _list = list
+
     def __init__(self, name: str = None, extension: str = None):
         super().__init__(default_section=None,
                          interpolation=None,
-                         dict_type=OrderedDict,
                          strict=False
                          )
         self.optionxform = str
         self.name = name
         self.extension = extension
         self._space_around_delimiters = False
-        if 'Unit' not in self.sections():
+        self._internal_sections = set()
+        # (section, header) pairs used by `_render`, see `_section_headers`
+        self._headers = None
+        if not self.has_section('Unit'):
             self.add_section('Unit')
 
+    def __deepcopy__(self, memo):
+        """Copy the config without a generic object walk
+
+        All attributes are carried over and only the containers holding the
+        options are duplicated. Option values are strings (or lists of strings
+        for multioptions), so they need no further copying.
+        """
+        cls = type(self)
+        new = cls.__new__(cls)
+        memo[id(self)] = new
+        new.__dict__.update(self.__dict__)
+        # the converters and section proxies refer to their parser
+        converters = ConverterMapping.__new__(ConverterMapping)
+        converters._parser = new
+        converters._data = dict(self._converters._data)
+        new._converters = converters
+        for name, converter in converters._data.items():
+            if converter is not None:
+                getter = functools.partial(new._get_conv, conv=converter)
+                getter.converter = converter
+                setattr(new, 'get' + name, getter)
+        dict_type = self._dict
+        new._defaults = dict_type(self._defaults)
+        new._sections = dict_type(
+            (section, dict_type(
+                (option, value[:] if isinstance(value, list) else value)
+                for option, value in options.items()
+            ))
+            for section, options in self._sections.items()
+        )
+        new._proxies = dict_type(
+            (section, SectionProxy(new, section)) for section in self._proxies
+        )
+        new._multioptions = {section: set(options)
+                             for section, options in self._multioptions.items()}
+        new._internal_sections = set(self._internal_sections)
+        return new
+
     def write_config(self, path: str, name: str = None):
         """Write the config to a file
         """
         if not name:
             raise ValueError('You need to provide a valid name for the unit'
                              f' file. "{name}" is not a valid name')
-        if self.extension and not name.endswith(self.extension):
-            name += f".{self.extension}"
+        if self._suffix and not name.endswith(self._suffix):
+            name += self._suffix
+
+        _write_unit_file(os.path.join(path, name), self._render())
+
+    @property
+    def extension(self):
+        """The unit type, used as file extension"""
+        return self._extension
 
-        export_u = self._externalise_internals()
+    @extension.setter
+    def extension(self, extension: str):
+        self._extension = extension
+        self._suffix = f".{extension}" if extension else ''
 
-        with open(os.path.join(path, name), 'w') as unitfobj:
-            export_u.write(
-                unitfobj,
-                space_around_delimiters=self._space_around_delimiters
+    def _render(self):
+        """Render the unit file content as a single string
+
+        Internal sections are written with the `x-' prefix such that systemd
+        ignores them.
+        """
+        plan, tail = self._render_plan()
+        parts = []
+        append = parts.append
+        for text, value in plan:
+            append(text)
+            append(str(value).replace('\n', '\n\t'))
+        append(tail)
+        return "".join(parts)
+
+    def _batch_renderer(self):
+        """Return a function rendering the unit file for some batch variables
+
+        Like `formatted` followed by `_render`, only the option values are
+        formatted, but the layout of the file is only built once.
+        """
+        compile_template = self._compile_template
+        plan, tail = self._render_plan()
+        plan = [(text, compile_template(value)) for text, value in plan]
+
+        def render(variables):
+            parts = []
+            append = parts.append
+            for text, template in plan:
+                append(text)
+                append(template(variables).replace('\n', '\n\t'))
+            append(tail)
+            return "".join(parts)
+        return render
+
+    def _render_plan(self):
+        """The layout of the unit file, shared by the renderers
+
+        Returns a list of (text preceding a value, value) pairs and the text
+        following the last value. Valueless options are part of the text.
+        """
+        if self._space_around_delimiters:
+            delimiter = f" {self._delimiters[0]} "
+        else:
+            delimiter = self._delimiters[0]
+        allow_no_value = self._allow_no_value
+        sections = self._sections
+        multioptions = self._multioptions
+        plan = []
+        literal = []
+        for section, header in self._section_headers():
+            literal.append(header)
+            multi = multioptions.get(section, ())
+            for key, value in sections[section].items():
+                if key not in multi:
+                    value = [value, ]
+                for _value in value:
+                    if _value is None and allow_no_value:
+                        literal.append(f"{key}\n")
+                    else:
+                        literal.append(f"{key}{delimiter}")
+                        plan.append(("".join(literal), _value))
+                        literal = ["\n"]
+            literal.append("\n")
+        return plan, "".join(literal)
+
+    def _section_headers(self):
+        """The sections in writing order along with their header line
+
+        The result is cached until sections are added, removed or change
+        between internal and external.
+        """
+        if self._headers is None:
+            self._headers = tuple(
+                (section, f"[x-{section}]\n")
+                if section in self._internal_sections
+                else (section, f"[{section}]\n")
+                for section in self._sections
             )
-        del export_u
+        return self._headers
 
     def to_dict(self):
         """Export the configuration to a dictionary
         """
-        return {sect: dict(self[sect])
-                for sect in self.sections()}
-
-    def _externalise_internals(self,):
-        external_u = copy.copy(self)
-        for section in external_u.sections():
-            if self.is_internal(section):
-                ext_sect = f"x-{section}"
-                external_u.add_section(ext_sect)
-                for item in external_u.items(section):
-                    external_u.set(ext_sect, item[0], item[1])
-                external_u.remove_section(section)
-        return external_u
+        # there is neither interpolation nor a default section to merge, so
+        # the stored options are returned without going through the proxies
+        return {sect: dict(options)
+                for sect, options in self._sections.items()}
 
     def _internalise_internals(self,):
-        internal_u = copy.copy(self)
-        for section in internal_u.sections():
-            if section.startswith('x-'):
-                int_sect = section[2:]
-                internal_u.add_section(int_sect)
-                for item in internal_u.items(section):
-                    internal_u.set(int_sect, item[0], item[1])
-                internal_u.remove_section(section)
-                internal_u.set_internal(int_sect)
-        return internal_u
+        """Turn all `x-' prefixed sections into internal sections (in place)
+        """
+        sections = self._sections
+        renamed = {section: section[2:]
+                   for section in sections
+                   if section.startswith('x-')}
+        if not renamed:
+            return
+        for int_sect in renamed.values():
+            if int_sect in sections:
+                raise DuplicateSectionError(int_sect)
+        self._sections = self._dict(
+            (renamed.get(section, section), options)
+            for section, options in sections.items()
+        )
+        multioptions = self._multioptions
+        proxies = self._proxies
+        for ext_sect, int_sect in renamed.items():
+            if ext_sect in multioptions:
+                multioptions[int_sect] = multioptions.pop(ext_sect)
+            del proxies[ext_sect]
+            proxies[int_sect] = SectionProxy(self, int_sect)
+        self._internal_sections.update(renamed.values())
+        self._headers = None
 
     def set_internal(self, section):
         """Set a section to internal (i.e. will be ignored by systemd)
         """
-        self[section]._internal = True
+        if section not in self._sections:
+            raise KeyError(section)
+        self._internal_sections.add(section)
+        self._headers = None
 
     def set_external(self, section):
         """Set a section to external (i.e. will be read by systemd)
@@ -80,7 +309,10 @@ class UnitConfig(MultiConfigParser):
           By default all sections are considered external, unless their name
           start with `x-'.
         """
-        self[section]._internal = False
+        if section not in self._sections:
+            raise KeyError(section)
+        self._internal_sections.discard(section)
+        self._headers = None
 
     def is_internal(self, section):
         """Check if a section is internal or not.
@@ -90,21 +322,156 @@ class UnitConfig(MultiConfigParser):
           It is not tested if a section does really exist. Non-existing
           sections are not considered internal.
         """
-        if getattr(self[section], '_internal', None):
-            return True
-        else:
-            return False
+        return section in self._internal_sections
+
+    def add_section(self, section):
+        self._headers = None
+        super().add_section(section)
+
+    def remove_section(self, section):
+        """Remove a section, dropping its internal flag along with it
+        """
+        self._internal_sections.discard(section)
+        self._headers = None
+        return super().remove_section(section)
+
+    def _read(self, fp, fpname):
+        self._headers = None
+        super()._read(fp, fpname)
 
     def read_config(self, name: str, path: str = None):
         """Read a systemd unit file
+
+        Internal sections are written with the `x-' prefix and become internal
+        sections again when the file is read:
+
+        >>> import tempfile
+        >>> tmp = tempfile.TemporaryDirectory()
+        >>> config = ServiceConfig('my_unit')
+        >>> config.update_internal_section('Meta', owner='me')
+        >>> config.write_config(tmp.name, name='my_unit')
+        >>> print(open(os.path.join(tmp.name, 'my_unit.service')).read())
+        [Unit]
+        <BLANKLINE>
+        [Service]
+        <BLANKLINE>
+        [x-Meta]
+        owner=me
+        <BLANKLINE>
+        <BLANKLINE>
+        >>> new_config = ServiceConfig('my_unit')
+        >>> new_config.read_config('my_unit.service', path=tmp.name)
+        >>> new_config.is_internal('Meta')
+        True
+        >>> new_config.to_dict()
+        {'Unit': {}, 'Service': {}, 'Meta': {'owner': 'me'}}
+        >>> tmp.cleanup()
         """
         if path is not None:
             filename = os.path.join(path, name)
         else:
             filename = name
 
-        self.read(filename)
-        self = self._internalise_internals()
+        # the fast reader supports neither strict parsing, interpolation nor
+        # valueless options
+        if self._strict or self._allow_no_value or \
+                type(self._interpolation) is not Interpolation:
+            try:
+                with open(filename, buffering=_BUFFER_SIZE,
+                          encoding='utf-8') as unitfobj:
+                    self.read_file(unitfobj)
+            except OSError:
+                # like `read`, ignore files that cannot be opened
+                return
+            self._internalise_internals()
+        else:
+            self._read_fast(filename)
+
+    def _read_fast(self, filename):
+        """Read a unit file without going through `configparser`
+
+        Only the part of the INI syntax used by systemd is supported, i.e.
+        `[Section]` headers, `Key=Value` options, full line comments and
+        indented continuation lines. Repeated options become multioptions and
+        `x-' prefixed sections are read as internal sections.
+
+        .. note::
+
+          Like `read`, a file that cannot be opened is silently ignored.
+        """
+        try:
+            with open(filename, buffering=_BUFFER_SIZE,
+                      encoding='utf-8') as unitfobj:
+                data = unitfobj.read()
+        except OSError:
+            return
+        sections = self._sections
+        sectcre = self.SECTCRE
+        comment_prefixes, _ = self._comment_prefix_groups()
+        optionxform = self.optionxform
+        multioptions = self._multioptions
+        store_option = self._store_option
+        # the same section and option names recur across many unit files
+        intern = sys.intern
+        cursect = None
+        sectname = None
+        optlines = None
+        pending = None
+        indent_level = 0
+        e = None
+        for lineno, line in enumerate(data.split('\n'), start=1):
+            value = line.strip()
+            if not value:
+                if optlines is not None:
+                    optlines.append('')  # newlines added at join
+                continue
+            if value.startswith(comment_prefixes):
+                continue
+            cur_indent_level = len(line) - len(line.lstrip())
+            # continuation line?
+            if optlines is not None and cur_indent_level > indent_level:
+                optlines.append(value)
+                continue
+            indent_level = cur_indent_level
+            mo = sectcre.match(value)
+            if mo:
+                if pending is not None:
+                    store_option(*pending)
+                    pending = None
+                sectname = mo.group('header')
+                internal = sectname.startswith('x-')
+                if internal:
+                    sectname = sectname[2:]
+                sectname = intern(sectname)
+                if sectname not in sections:
+                    self.add_section(sectname)
+                    if internal:
+                        self.set_internal(sectname)
+                elif internal != self.is_internal(sectname):
+                    raise DuplicateSectionError(sectname, filename, lineno)
+                cursect = sections[sectname]
+                optlines = None
+            elif cursect is None:
+                raise MissingSectionHeaderError(filename, lineno, line)
+            else:
+                optname, delimiter, optval = value.partition('=')
+                optname = intern(optionxform(optname.rstrip()))
+                if not delimiter or not optname:
+                    e = self._handle_error(e, filename, lineno, line)
+                    continue
+                if pending is not None:
+                    store_option(*pending)
+                optlines = [optval.strip()]
+                multi = optname in cursect
+                if multi:
+                    multioptions.setdefault(sectname, set()).add(optname)
+                    if not isinstance(cursect[optname], list):
+                        cursect[optname] = [cursect[optname]]
+                pending = (cursect, sectname, optname, optlines, multi)
+        if pending is not None:
+            store_option(*pending)
+        if e:
+            raise e
 
     def update_section(self, name: str, **options):
         """Adds or updates a section to the unit that is relevant for systemd
@@ -115,30 +482,44 @@ class UnitConfig(MultiConfigParser):
           the `update_internal_section` method instead.
 
         """
-        if name not in self.sections():
+        if not self.has_section(name):
             self.add_section(name)
-        self[name]._internal = False
-        self[name].update(options)
+        self.set_external(name)
+        for option, value in options.items():
+            self._validate_value_types(option=option, value=value)
+        # write straight to the underlying dict (optionxform is `str`)
+        self._sections[name].update(options)
 
     def update_internal_section(self, name: str, **options):
         """Adds or updates a section that should be ignored by systemd
         """
         if name.startswith('x-'):
             name = name[2:]
-        if name not in self.sections():
+        if not self.has_section(name):
             self.add_section(name)
-        self[name]._internal = True
-        self[name].update({k: str(v) for k, v in options.items()})
+        self.set_internal(name)
+        self._sections[name].update({k: str(v) for k, v in options.items()})
 
     def pop_section(self, name: str):
         """Return and remove a section from the configuration.
 
         **Note:**
 
-        Only the content of the section is returned and **not** the section
-        object itself.
+        Only the content of the section is returned, as a dictionary, and
+        **not** the section object itself.
+
+        Example:
+
+        >>> config = ServiceConfig('my_unit')
+        >>> config.update_section('Service', ExecStart='/bin/true')
+        >>> config.pop_section('Service')
+        {'ExecStart': '/bin/true'}
+        >>> config.sections()
+        ['Unit']
         """
-        section = {item for item in self.items(name)}
+        if not self.has_section(name):
+            raise NoSectionError(name)
+        section = dict(self._sections[name])
         self.remove_section(name)
         return section
 
@@ -146,25 +527,17 @@ class UnitConfig(MultiConfigParser):
     def formatted(self, new_config, **variables):
         """Return a copy of this instance with formatted values of the options
         """
-        for section in new_config.sections():
-            for name, value in new_config.items(section):
-                _multiopt = False
-                if (section, name) in self._multioptions:
-                    _multiopt = True
-                    value_formatted = [val.format(**variables)
-                                       for val in value]
+        # new_config is a copy with the same structure, so the values are
+        # replaced in place, the multioption flags are already set
+        compile_template = self._compile_template
+        is_instance, list_type = self._isinstance, self._list
+        for options in new_config._sections.values():
+            for name, value in options.items():
+                if is_instance(value, list_type):
+                    options[name] = [compile_template(val)(variables)
+                                     for val in value]
                 else:
-                    try:
-                        value_formatted = value.format(**variables)
-                    except AttributeError:
-                        value_formatted = [val.format(**variables)
-                                           for val in value]
-                new_config.set(
-                    section,
-                    name,
-                    value_formatted,
-                    multioption=_multiopt
-                )
+                    options[name] = compile_template(value)(variables)
         return new_config
 
 
@@ -176,19 +549,19 @@ class TargetConfig(UnitConfig):
 class ServiceConfig(UnitConfig):
     def __init__(self, name: str = None):
         super().__init__(name=name, extension='service')
-        if 'Service' not in self.sections():
+        if not self.has_section('Service'):
             self.add_section('Service')
 
 
 class TimerConfig(UnitConfig):
     def __init__(self, name: str = None):
         super().__init__(name=name, extension='timer')
-        if 'Timer' not in self.sections():
+        if not self.has_section('Timer'):
             self.add_section('Timer')
 
 
 class PathConfig(UnitConfig):
     def __init__(self, name: str = None):
         super().__init__(name=name, extension='path')
-        if 'Path' not in self.sections():
+        if not self.has_section('Path'):
             self.add_section('Path')
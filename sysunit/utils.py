@@ -1,5 +1,45 @@
 import types
+import string
+import functools
 
 noglobals = lambda fct: types.FunctionType(fct.__code__,
                                           {},
                                           argdefs=fct.__defaults__)
+
+_parse_template = string.Formatter().parse
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_template(template: str):
+    """Parse a format template once and return a `format_map` equivalent
+
+    Templates with only plain `{name}` fields are split into their literal
+    parts and field names, so formatting does not parse the template again.
+    Any other template falls back to `template.format_map`, so malformed
+    templates still only fail once they are formatted.
+    """
+    segments = []
+    try:
+        for literal, field, spec, conversion in _parse_template(template):
+            if field is None:
+                segments.append((literal, None))
+            elif spec or conversion or not field.isidentifier():
+                return template.format_map
+            else:
+                segments.append((literal, field))
+    except ValueError:
+        return template.format_map
+    if not any(field for _, field in segments):
+        # nothing to format, only the `{{` and `}}` escapes are resolved
+        text = ''.join(literal for literal, _ in segments)
+        return lambda variables: text
+
+    def _format(variables):
+        parts = []
+        append = parts.append
+        for literal, field in segments:
+            append(literal)
+            if field is not None:
+                append(format(variables[field]))
+        return ''.join(parts)
+    return _format